@@ -16,19 +16,32 @@ Output:
   output/data/{year}/{team_id}_leverage.csv
   output/data/{year}/{team_id}_vs_leverage.csv
 
+With --format parquet the per-team files are replaced by four zstd-compressed
+"season packs" holding all teams (filter on the team_id column):
+  output/data/{year}/team.parquet
+  output/data/{year}/team_vs.parquet
+  output/data/{year}/team_leverage.parquet
+  output/data/{year}/team_vs_leverage.parquet
+
 Usage:
   python fetch_onoff.py --year 2026
+  python fetch_onoff.py --year 2026 --format parquet
+  python fetch_onoff.py --year 2026 --force   # refetch files already on disk
 """
 
 import argparse
 import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 
 def current_nba_season():
@@ -61,8 +74,9 @@ HEADERS = {
         "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,"
         "image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7"
     ),
-    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Encoding": "gzip",  # br needs brotli installed to decode
     "Accept-Language": "en-US,en;q=0.9",
+    "Connection": "keep-alive",
     "Sec-Ch-Ua": '"Not/A)Brand";v="99", "Microsoft Edge";v="115", "Chromium";v="115"',
     "Sec-Ch-Ua-Mobile": "?0",
     "Sec-Ch-Ua-Platform": '"Windows"',
@@ -73,12 +87,72 @@ HEADERS = {
     "Cache-Control": "max-age=0",
 }
 
-SLEEP_BETWEEN = 1.0  # seconds between API calls
-MAX_RETRIES = 5
-RETRY_DELAY = 3  # seconds between retries
+RATE_LIMIT = 3.0  # API calls per second, shared by all workers
+MAX_WORKERS = 6  # concurrent API calls, shared across both blocks
+MAX_RETRIES = 5  # attempts per API call
+RETRY_DELAY = 3  # seconds before the first retry, doubled after each later failure
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+PAYLOAD_RETRIES = 2  # extra attempts for a 200 with a truncated/unexpected body
 REQUEST_TIMEOUT = (10, 60)  # (connect, read)
 SPLIT_TIMEOUT = (10, 90)  # longer timeout for date-filtered queries
 
+# One keep-alive session for every call so the TLS handshake to
+# api.pbpstats.com is paid once rather than per request. Retries are done in
+# _api_call (not the adapter) so every attempt goes through the rate limiter.
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=0))
+
+# Transport failures worth another attempt; other HTTP errors fail at once
+_RETRY_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# Session headers are merged and encoded once here; each call copies this and
+# only fills in its query string and current session cookies.
+_WOWY_TEMPLATE = SESSION.prepare_request(requests.Request("GET", WOWY_URL))
+
+
+class RateLimiter:
+    """Thread-safe token bucket: up to `rate` calls/sec, bursts of `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available, then take it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_limiter = RateLimiter(RATE_LIMIT)
+
+# Both blocks run at once; this caps requests in flight across all of them
+_inflight = threading.BoundedSemaphore(MAX_WORKERS)
+
+
+def _log(msg):
+    """Print one line from a worker thread.
+
+    print() writes the text and the newline separately, so concurrent calls
+    can merge lines; a single write keeps each message on its own line.
+    """
+    sys.stdout.write(msg + "\n")
+
 
 # ---------------------------------------------------------------------------
 # API
@@ -87,7 +161,16 @@ SPLIT_TIMEOUT = (10, 90)  # longer timeout for date-filtered queries
 def fetch_team_ids(year=REFERENCE_YEAR):
     """Get unique team IDs from index_master.csv on GitHub."""
     print(f"Fetching index_master.csv (reference year {year})...")
-    df = pd.read_csv(INDEX_MASTER_URL)
+    # Stream through the shared session and parse only the columns we use.
+    # year/team_id are read as float so blanks and "2025.0"-style values parse.
+    with SESSION.get(INDEX_MASTER_URL, stream=True, timeout=REQUEST_TIMEOUT) as resp:
+        resp.raise_for_status()
+        resp.raw.decode_content = True
+        df = pd.read_csv(
+            resp.raw,
+            usecols=["team", "year", "team_id"],
+            dtype={"team": "string", "year": "float64", "team_id": "float64"},
+        )
     df = df.dropna()
     df = df[df.team != "TOT"]
     df = df[df.year == year].drop_duplicates()
@@ -96,21 +179,50 @@ def fetch_team_ids(year=REFERENCE_YEAR):
     return team_ids
 
 
+def _retry_after(resp):
+    """Seconds requested by a Retry-After header (0 if absent or not a number)."""
+    value = resp.headers.get("Retry-After", "")
+    return float(value) if value.isdigit() else 0.0
+
+
 def _api_call(params, timeout=REQUEST_TIMEOUT):
-    """Single PBPStats API call with retries."""
+    """Single PBPStats API call with retries.
+
+    Connection errors, timeouts and 429/5xx responses are retried up to
+    MAX_RETRIES attempts, waiting RETRY_DELAY, 2x, 4x, ... seconds (longer if
+    Retry-After asks for it). A 200 whose body is truncated, not a JSON object, or
+    lacks the table gets PAYLOAD_RETRIES more attempts; any other HTTP error fails at once.
+    Every attempt takes a rate-limiter token, and the in-flight slot is freed
+    while backing off.
+    """
+    req = _WOWY_TEMPLATE.copy()
+    req.prepare_url(WOWY_URL, params)
+    req.prepare_cookies(SESSION.cookies)
+    # What Session.request would add: env proxies, REQUESTS_CA_BUNDLE, etc.
+    send_kwargs = SESSION.merge_environment_settings(req.url, {}, None, None, None)
+    payload_failures = 0
+
     for attempt in range(1, MAX_RETRIES + 1):
+        last = attempt == MAX_RETRIES
+        delay = RETRY_DELAY * 2 ** (attempt - 1)
+        _limiter.acquire()
         try:
-            resp = requests.get(
-                WOWY_URL, params=params, headers=HEADERS, timeout=timeout
-            )
+            with _inflight:
+                resp = SESSION.send(req, timeout=timeout, **send_kwargs)
+            if resp.status_code in RETRY_STATUSES and not last:
+                time.sleep(max(delay, _retry_after(resp)))
+                continue
             resp.raise_for_status()
-            data = resp.json()["multi_row_table_data"]
-            return pd.DataFrame(data, index=[0] * len(data))
-        except Exception as e:
-            if attempt < MAX_RETRIES:
-                time.sleep(RETRY_DELAY)
-            else:
+            data = orjson.loads(resp.content)["multi_row_table_data"]
+            return pd.DataFrame.from_records(data)
+        except _RETRY_ERRORS:
+            if last:
+                raise
+        except (ValueError, KeyError, TypeError):
+            payload_failures += 1
+            if last or payload_failures > PAYLOAD_RETRIES:
                 raise
+        time.sleep(delay)
 
 
 def lineuppull(team_id, season, opp=False, leverage=False):
@@ -160,7 +272,7 @@ def lineuppull_full(team_id, year, season, opp=False, leverage=False):
     # Hit the cap — re-fetch with date splits
     side = "Opponent" if opp else "Team"
     tag = "leverage" if leverage else "non-leverage"
-    print(f"    {team_id} ({side}/{tag}): hit {ROW_CAP}-row cap, splitting by date...")
+    _log(f"    {team_id} ({side}/{tag}): hit {ROW_CAP}-row cap, splitting by date...")
 
     splits = [
         (f"{year - 1}-10-01", f"{year}-01-15"),
@@ -169,7 +281,6 @@ def lineuppull_full(team_id, year, season, opp=False, leverage=False):
 
     split_dfs = []
     for from_d, to_d in splits:
-        time.sleep(SLEEP_BETWEEN)
         params = {
             "TeamId": team_id,
             "Season": season,
@@ -182,83 +293,201 @@ def lineuppull_full(team_id, year, season, opp=False, leverage=False):
             params["Leverage"] = "Medium,High,VeryHigh"
 
         split_df = _api_call(params, timeout=SPLIT_TIMEOUT)
-        print(f"      {from_d} to {to_d}: {len(split_df)} lineups")
+        _log(f"      {from_d} to {to_d}: {len(split_df)} lineups")
         split_dfs.append(split_df)
 
     combined = _combine_split_halves(split_dfs)
-    print(f"    Combined: {len(combined)} unique lineups (was capped at {ROW_CAP})")
+    _log(f"    Combined: {len(combined)} unique lineups (was capped at {ROW_CAP})")
     return combined
 
 
-def get_filename(team_id, opp=False, leverage=False):
-    """Generate filename: {team_id}[_vs][_leverage].csv"""
+def get_filename(team_id, opp=False, leverage=False, fmt="csv"):
+    """Generate filename: {team_id}[_vs][_leverage].{csv,parquet}"""
     name = str(team_id)
     if opp:
         name += "_vs"
     if leverage:
         name += "_leverage"
-    name += ".csv"
+    name += f".{fmt}"
     return name
 
 
+def get_pack_filename(opp=False, leverage=False):
+    """Generate season pack filename: team[_vs][_leverage].parquet"""
+    return get_filename("team", opp=opp, leverage=leverage, fmt="parquet")
+
+
+def get_part_filename(team_id, opp=False, leverage=False):
+    """Generate per-team pack checkpoint filename: {team_id}[_vs][_leverage].parquet.part"""
+    return get_filename(team_id, opp=opp, leverage=leverage, fmt="parquet") + ".part"
+
+
+def write_frame(df, filepath, fmt="csv"):
+    """Write a frame as CSV or zstd-compressed Parquet.
+
+    Writes to a .tmp sibling and renames it into place, so an interrupted run
+    never leaves a partial file that the next run would treat as done.
+    """
+    tmp_path = filepath + ".tmp"
+    if fmt == "parquet":
+        df.to_parquet(tmp_path, compression="zstd", index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, filepath)
+
+
+def _saved_team_ids(output_dir, team_ids, opp, leverage, fmt):
+    """Team ids whose output for this side/block was saved by an earlier run.
+
+    Only checks what is on disk: file existence for CSV; for parquet, the
+    team_id column of the season pack plus any leftover .part checkpoints.
+    """
+    if fmt == "parquet":
+        saved = {
+            team_id for team_id in team_ids
+            if os.path.exists(os.path.join(
+                output_dir, get_part_filename(team_id, opp=opp, leverage=leverage)
+            ))
+        }
+        path = os.path.join(output_dir, get_pack_filename(opp=opp, leverage=leverage))
+        if os.path.exists(path):
+            packed = pd.read_parquet(path, columns=["team_id"])["team_id"].unique().tolist()
+            saved |= set(packed) & set(team_ids)
+        return saved
+
+    saved = set()
+    for team_id in team_ids:
+        path = os.path.join(output_dir, get_filename(team_id, opp=opp, leverage=leverage))
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            saved.add(team_id)
+    return saved
+
+
+def _write_pack(output_dir, team_ids, opp, leverage):
+    """Merge this side's .part checkpoints into its season pack.
+
+    Rows for those teams replace any already in the pack, and the parts are
+    removed only after the pack has been written. Returns the pack filename,
+    or None if there was nothing to merge.
+    """
+    parts = [
+        path for path in (
+            os.path.join(output_dir, get_part_filename(t, opp=opp, leverage=leverage))
+            for t in team_ids
+        )
+        if os.path.exists(path)
+    ]
+    if not parts:
+        return None
+
+    filename = get_pack_filename(opp=opp, leverage=leverage)
+    path = os.path.join(output_dir, filename)
+    pack = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True)
+    if os.path.exists(path):
+        existing = pd.read_parquet(path)
+        existing = existing[~existing["team_id"].isin(pack["team_id"].unique())]
+        pack = pd.concat([existing, pack], ignore_index=True)
+    pack = pack.sort_values("team_id", kind="stable").reset_index(drop=True)
+    write_frame(pack, path, "parquet")
+    for part in parts:
+        os.remove(part)
+    _log(f"  Saved {filename} ({pack['team_id'].nunique()} teams, {len(pack)} rows)")
+    return filename
+
+
 # ---------------------------------------------------------------------------
 # Fetch block
 # ---------------------------------------------------------------------------
 
-def pull_block(team_ids, year, leverage=False):
+def _fetch_one(team_id, opp, year, season, leverage, output_dir, fmt):
+    """Fetch, tag and save one team/side. Runs on a worker thread.
+
+    Returns (df, filename), with filename None if no output file was written:
+    the frame was too small to save, or (parquet) it was checkpointed as a
+    .part file for pull_block to merge into the block's pack.
+    """
+    df = lineuppull_full(team_id, year, season, opp=opp, leverage=leverage)
+
+    df = df.assign(team_id=team_id, year=year, season=season, team_vs=opp)
+    if "Corner3FGM" not in df.columns:
+        df["Corner3FGM"] = 0
+
+    filename = get_filename(team_id, opp=opp, leverage=leverage, fmt=fmt)
+    if len(df) <= 2:
+        _log(f"  Skipped {filename} (only {len(df)} rows)")
+        return df, None
+    if fmt == "parquet":
+        part = get_part_filename(team_id, opp=opp, leverage=leverage)
+        write_frame(df, os.path.join(output_dir, part), fmt)
+        _log(f"  Fetched {filename.rsplit('.', 1)[0]} ({len(df)} rows)")
+        return df, None
+    write_frame(df, os.path.join(output_dir, filename), fmt)
+    _log(f"  Saved {filename} ({len(df)} rows)")
+    return df, filename
+
+
+def pull_block(team_ids, year, leverage=False, fmt="csv", force=False):
     """
     Run one block of fetches (leverage or non-leverage).
-    For each team: Team + Opponent = 2 calls.
-    Returns (team_frames, vs_frames, fail_list).
+    For each team: Team + Opponent = 2 calls, spread over MAX_WORKERS threads.
+    Team/sides already saved by an earlier run are skipped unless force is
+    set. With fmt="parquet" each team/side is checkpointed as a .part file and
+    the parts are merged into each side's season pack at the end (also when
+    the block is interrupted, so finished teams are never lost).
+    Returns (team_frames, vs_frames, fail_list, written); the frames cover only
+    team/sides fetched by this run.
     """
     season = f"{year - 1}-{str(year)[-2:]}"
     output_dir = f"output/data/{year}"
     os.makedirs(output_dir, exist_ok=True)
 
     tag = "leverage" if leverage else "non-leverage"
-    team_frames = []
-    vs_frames = []
-    fail_list = []
-
-    for opp in [False, True]:
-        side = "Opponent" if opp else "Team"
-        print(f"\n--- {tag} / {side} ---")
-
-        for team_id in team_ids:
-            filename = get_filename(team_id, opp=opp, leverage=leverage)
-            filepath = os.path.join(output_dir, filename)
-
-            try:
-                df = lineuppull_full(
-                    team_id, year, season, opp=opp, leverage=leverage
-                )
-            except Exception as e:
-                print(f"  FAILED {team_id} ({side}): {e}")
-                fail_list.append((team_id, side))
-                continue
-
-            df = df.reset_index(drop=True)
-            df["team_id"] = team_id
-            df["year"] = year
-            df["season"] = season
-            df["team_vs"] = opp
-            if "Corner3FGM" not in df.columns:
-                df["Corner3FGM"] = 0
+    _log(f"\n--- {tag}: {len(team_ids)} teams x Team/Opponent ---")
 
-            if len(df) > 2:
-                df.to_csv(filepath, index=False)
-                print(f"  Saved {filename} ({len(df)} rows)")
-            else:
-                print(f"  Skipped {filename} (only {len(df)} rows)")
-
-            if opp:
-                vs_frames.append(df)
-            else:
-                team_frames.append(df)
-
-            time.sleep(SLEEP_BETWEEN)
-
-    return team_frames, vs_frames, fail_list
+    results = {}
+    fail_list = []
+    written = []
+
+    tasks = []
+    skipped = 0
+    for opp in (False, True):
+        saved = set() if force else _saved_team_ids(output_dir, team_ids, opp, leverage, fmt)
+        skipped += len(saved)
+        tasks += [(team_id, opp) for team_id in team_ids if team_id not in saved]
+    if skipped:
+        _log(
+            f"  {tag}: {skipped} team/sides already saved, skipping (--force to refetch;"
+            f" sides with <=2 rows are never saved, so they are always refetched)"
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+            futures = {
+                ex.submit(_fetch_one, tid, opp, year, season, leverage, output_dir, fmt): (tid, opp)
+                for tid, opp in tasks
+            }
+            for fut in as_completed(futures):
+                team_id, opp = futures[fut]
+                side = "Opponent" if opp else "Team"
+                try:
+                    results[(team_id, opp)], filename = fut.result()
+                except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+                    _log(f"  FAILED {team_id} ({side}): {e}")
+                    fail_list.append((team_id, side))
+                    continue
+                if filename:
+                    written.append(filename)
+    finally:
+        if fmt == "parquet":
+            for opp in (False, True):
+                filename = _write_pack(output_dir, team_ids, opp, leverage)
+                if filename:
+                    written.append(filename)
+
+    # Keep frame order stable (team_ids order) regardless of completion order
+    team_frames = [results[(t, False)] for t in team_ids if (t, False) in results]
+    vs_frames = [results[(t, True)] for t in team_ids if (t, True) in results]
+    return team_frames, vs_frames, fail_list, written
 
 
 # ---------------------------------------------------------------------------
@@ -268,6 +497,17 @@ def pull_block(team_ids, year, leverage=False):
 def main():
     parser = argparse.ArgumentParser(description="Fetch PBPStats on-off data")
     parser.add_argument("--year", type=int, default=None, help="Season year (auto-detects if omitted)")
+    parser.add_argument(
+        "--format", choices=["csv", "parquet"], default="csv",
+        help=(
+            "Output format: csv writes one file per team/side (default); parquet "
+            "writes four zstd season packs per year (needs pyarrow installed)"
+        ),
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="Refetch teams whose output file already exists",
+    )
     args = parser.parse_args()
 
     year = args.year or current_nba_season()
@@ -279,24 +519,23 @@ def main():
 
     start = time.time()
 
-    # Block 1: Leverage
+    # Both blocks run concurrently; output from the two is interleaved
     print("=" * 60)
     print("BLOCK 1: LEVERAGE (Medium,High,VeryHigh)")
-    print("=" * 60)
-    lev_team, lev_vs, lev_fails = pull_block(team_ids, year, leverage=True)
-
-    # Block 2: Non-leverage
-    print("\n" + "=" * 60)
     print("BLOCK 2: NON-LEVERAGE (all possessions)")
     print("=" * 60)
-    nl_team, nl_vs, nl_fails = pull_block(team_ids, year, leverage=False)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_lev = ex.submit(pull_block, team_ids, year, True, args.format, args.force)
+        fut_nl = ex.submit(pull_block, team_ids, year, False, args.format, args.force)
+        lev_team, lev_vs, lev_fails, lev_written = fut_lev.result()
+        nl_team, nl_vs, nl_fails, nl_written = fut_nl.result()
 
     # Summary
     elapsed = time.time() - start
     all_fails = lev_fails + nl_fails
 
     data_dir = f"output/data/{year}"
-    file_count = len([f for f in os.listdir(data_dir) if f.endswith(".csv")])
+    file_count = len(lev_written) + len(nl_written)
 
     print(f"\n{'=' * 60}")
     print(f"DONE in {elapsed:.0f}s")
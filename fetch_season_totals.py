@@ -11,12 +11,18 @@ Each run replaces the current year's row with fresh data.
 """
 
 import argparse
+import os
+import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
+import numpy as np
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 
 def current_nba_season():
@@ -39,7 +45,7 @@ HEADERS = {
         "image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7"
     ),
     "Accept-Language": "en-US,en;q=0.9",
-    "Accept-Encoding": "gzip, deflate, br",
+    "Accept-Encoding": "gzip",  # br needs brotli installed to decode
     "DNT": "1",
     "Connection": "keep-alive",
     "Upgrade-Insecure-Requests": "1",
@@ -52,6 +58,24 @@ HEADERS = {
 
 DATA_DIR = Path(__file__).resolve().parent / "data"
 
+# (label, season_type, leverage, csv filename)
+TOTALS_FILES = [
+    ("Regular Season", "Regular Season", False, "season_totals.csv"),
+    ("Playoffs", "Playoffs", False, "season_totals_playoffs.csv"),
+    ("Regular Season (Leverage)", "Regular Season", True, "season_totals_leverage.csv"),
+    ("Playoffs (Leverage)", "Playoffs", True, "season_totals_playoffs_leverage.csv"),
+]
+
+# Reuse one keep-alive connection across all fetches
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=0))
+
+
+def _log(msg):
+    """Print one line from a worker thread as a single write, so lines don't merge."""
+    sys.stdout.write(msg + "\n")
+
 
 def fetch_totals(year, season_type="Regular Season", leverage=False):
     """Fetch a single season's totals from PBPStats."""
@@ -69,34 +93,40 @@ def fetch_totals(year, season_type="Regular Season", leverage=False):
 
     for attempt in range(1, max_retries + 1):
         try:
-            time.sleep(2)
-            resp = requests.get(url, params=params, headers=HEADERS, timeout=(10, 30))
-            data = resp.json()
+            resp = SESSION.get(url, params=params, timeout=(10, 30))
+            data = orjson.loads(resp.content)
             row = data["single_row_table_data"]
             row["year"] = year
-            print(f"  Fetched: year={year} type={season_type} leverage={leverage}")
+            _log(f"  Fetched: year={year} type={season_type} leverage={leverage}")
             return pd.DataFrame([row])
         except Exception as e:
-            print(f"  Attempt {attempt}/{max_retries} failed: {e}")
+            _log(f"  Attempt {attempt}/{max_retries} failed ({season_type}, leverage={leverage}): {e}")
             if attempt < max_retries:
                 time.sleep(2)
             else:
-                print(f"  Max retries reached, skipping.")
+                _log(f"  Max retries reached for {season_type} (leverage={leverage}), skipping.")
                 return pd.DataFrame()
 
 
 def add_derived_cols(df):
-    """Add FTA_Rate and TOV% columns."""
-    fga = df["FG3A"] + df["FG2A"]
-    df["FTA_Rate"] = df["FTA"] / fga
-    df["TOV%"] = 100 * df["Turnovers"] / (
-        fga + (0.44 * df["FTA"]) + df["Turnovers"] - df["OffRebounds"]
-    )
+    """Add FTA_Rate and TOV% columns (computed on raw arrays, no index alignment)."""
+    fta = df["FTA"].to_numpy(dtype=float)
+    tov = df["Turnovers"].to_numpy(dtype=float)
+    fga = df["FG3A"].to_numpy(dtype=float) + df["FG2A"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        df["FTA_Rate"] = fta / fga
+        df["TOV%"] = 100 * tov / (
+            fga + (0.44 * fta) + tov - df["OffRebounds"].to_numpy(dtype=float)
+        )
     return df
 
 
 def update_csv(csv_path, new_data, year):
-    """Load existing CSV, replace current year rows, append new data."""
+    """Load existing CSV, replace current year rows, append new data.
+
+    The result is written to a .tmp sibling and renamed over the original, so
+    readers never see a half-written file.
+    """
     if csv_path.exists():
         existing = pd.read_csv(csv_path)
         print(f"  Loaded {len(existing)} rows from {csv_path.name}")
@@ -105,11 +135,22 @@ def update_csv(csv_path, new_data, year):
         existing = pd.DataFrame()
         print(f"  {csv_path.name} not found, creating new")
 
+    # existing no longer holds `year`, so appending can't create duplicates
     combined = pd.concat([existing, new_data], ignore_index=True)
-    combined = combined.drop_duplicates(subset=["year"], keep="last")
-    combined = combined.sort_values("year").reset_index(drop=True)
-    combined = add_derived_cols(combined)
-    combined.to_csv(csv_path, index=False)
+    if not combined["year"].is_monotonic_increasing:
+        combined = combined.sort_values("year").reset_index(drop=True)
+
+    # Prior years already carry their derived columns; only the new year needs
+    # them. Derive after the concat so a stat-less row (e.g. playoffs not yet
+    # started) still has every input column, as NaN.
+    mask = combined["year"] == year
+    derived = add_derived_cols(combined.loc[mask].copy())
+    for col in ("FTA_Rate", "TOV%"):
+        combined.loc[mask, col] = derived[col]
+
+    tmp_path = csv_path.with_suffix(".csv.tmp")
+    combined.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, csv_path)
     print(f"  Saved {len(combined)} rows to {csv_path.name}")
     return combined
 
@@ -122,29 +163,19 @@ def main():
 
     print(f"=== fetch_season_totals.py (year={year}) ===\n")
 
-    # 1. Regular Season (non-leverage)
-    print("--- Regular Season ---")
-    rs_data = fetch_totals(year, "Regular Season", leverage=False)
-    if not rs_data.empty:
-        update_csv(DATA_DIR / "season_totals.csv", rs_data, year)
-
-    # 2. Playoffs (non-leverage)
-    print("\n--- Playoffs ---")
-    ps_data = fetch_totals(year, "Playoffs", leverage=False)
-    if not ps_data.empty:
-        update_csv(DATA_DIR / "season_totals_playoffs.csv", ps_data, year)
-
-    # 3. Regular Season (leverage)
-    print("\n--- Regular Season (Leverage) ---")
-    rs_lev = fetch_totals(year, "Regular Season", leverage=True)
-    if not rs_lev.empty:
-        update_csv(DATA_DIR / "season_totals_leverage.csv", rs_lev, year)
-
-    # 4. Playoffs (leverage)
-    print("\n--- Playoffs (Leverage) ---")
-    ps_lev = fetch_totals(year, "Playoffs", leverage=True)
-    if not ps_lev.empty:
-        update_csv(DATA_DIR / "season_totals_playoffs_leverage.csv", ps_lev, year)
+    # The four fetches are independent, so run them together and then
+    # update the CSVs one at a time in a fixed order.
+    with ThreadPoolExecutor(max_workers=len(TOTALS_FILES)) as ex:
+        futures = [
+            ex.submit(fetch_totals, year, season_type, leverage)
+            for _, season_type, leverage, _ in TOTALS_FILES
+        ]
+
+    for (label, _, _, filename), fut in zip(TOTALS_FILES, futures):
+        print(f"\n--- {label} ---")
+        data = fut.result()
+        if not data.empty:
+            update_csv(DATA_DIR / filename, data, year)
 
     print("\nDone.")
 